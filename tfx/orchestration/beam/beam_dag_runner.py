@@ -17,9 +17,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import copy
 import datetime
+import functools
 import os
 import re
+import time
+
+from concurrent import futures
 
 import apache_beam as beam
 import tensorflow as tf
@@ -31,6 +37,39 @@ from tfx.orchestration import data_types
 from tfx.orchestration import pipeline
 from tfx.orchestration import tfx_runner
 
+# Google Dataflow restricts job names to only alphanumeric and dashes.
+_JOB_NAME_RE = re.compile(r'[^0-9a-zA-Z-]+')
+
+# Default of next() on a signal, which is only returned if the signal is empty.
+_EMPTY_SENTINEL = object()
+
+
+# Beam runners which execute the pipeline in the local process.
+_LOCAL_RUNNERS = frozenset(
+    ['direct', 'directrunner', 'bundlebaseddirectrunner',
+     'switchingdirectrunner'])
+
+
+def _is_local_runner(beam_orchestrator_args: List[Text]) -> bool:
+  """Returns whether beam orchestrator args request a local runner."""
+  runner = beam.options.pipeline_options.PipelineOptions(
+      flags=beam_orchestrator_args).view_as(
+          beam.options.pipeline_options.StandardOptions).runner
+  return not runner or runner.lower() in _LOCAL_RUNNERS
+
+
+def _get_direct_num_workers(
+    beam_orchestrator_args: List[Text]) -> Optional[int]:
+  """Returns --direct_num_workers of beam orchestrator args if set."""
+  return beam.options.pipeline_options.PipelineOptions(
+      flags=beam_orchestrator_args).get_all_options().get('direct_num_workers')
+
+
+@functools.lru_cache()
+def _to_job_name_part(name: Text) -> Text:
+  """Lowercases name and replaces characters not allowed in a job name."""
+  return _JOB_NAME_RE.sub('-', name.lower())
+
 
 # TODO(jyzhao): confirm it's re-executable, add test case.
 @beam.typehints.with_input_types(Any)
@@ -39,38 +78,62 @@ class _ComponentAsDoFn(beam.DoFn):
   """Wrap component as beam DoFn."""
 
   def __init__(self, component: base_component.BaseComponent,
-               tfx_pipeline: pipeline.Pipeline):
+               tfx_pipeline: pipeline.Pipeline, run_timestamp: int,
+               beam_pipeline_args: List[Text]):
     """Initialize the _ComponentAsDoFn.
 
     Args:
       component: Component that to be executed.
       tfx_pipeline: Logical pipeline that contains pipeline related information.
+      run_timestamp: Timestamp in seconds of current pipeline run, used in the
+        beam job name of the component.
+      beam_pipeline_args: Beam pipeline args of the pipeline without any job
+        name, shared by all components of current pipeline run.
     """
-    driver_args = data_types.DriverArgs(enable_cache=tfx_pipeline.enable_cache)
-    self._additional_pipeline_args = tfx_pipeline.additional_pipeline_args.copy()
-    _job_name = re.sub(
-      r'[^0-9a-zA-Z-]+',
-      '-',
-      '{pipeline_name}-{component}-{ts}'.format(
-        pipeline_name=tfx_pipeline.pipeline_info.pipeline_name,
-        component=component.component_id,
-        ts=int(datetime.datetime.timestamp(datetime.datetime.now()))
-      ).lower()
-    )
-    self._additional_pipeline_args['beam_pipeline_args'] = [
-      arg for arg in self._additional_pipeline_args.setdefault(
-        'beam_pipeline_args', []) if not arg.startswith("--job_name")
-    ]
-    self._additional_pipeline_args['beam_pipeline_args'].append(
-          '--job_name={}'.format(_job_name))
-
-    self._component_launcher = component_launcher.ComponentLauncher(
-        component=component,
-        pipeline_info=tfx_pipeline.pipeline_info,
-        driver_args=driver_args,
-        metadata_connection_config=tfx_pipeline.metadata_connection_config,
-        additional_pipeline_args=self._additional_pipeline_args)
+    # Dashes are allowed in job names, so the parts can be sanitized
+    # separately and reused across components and runs.
+    _job_name = '{pipeline_name}-{component}-{ts}'.format(
+        pipeline_name=_to_job_name_part(
+            tfx_pipeline.pipeline_info.pipeline_name),
+        component=_to_job_name_part(component.component_id),
+        ts=run_timestamp)
+    self._additional_pipeline_args = dict(
+        tfx_pipeline.additional_pipeline_args,
+        beam_pipeline_args=beam_pipeline_args +
+        ['--job_name={}'.format(_job_name)])
+
+    # Only keeps what the launcher needs instead of the component itself,
+    # which references the whole pipeline through its upstream and downstream
+    # nodes and would otherwise be pickled with the DoFn.
+    self._component_info = data_types.ComponentInfo(
+        component_type=component.component_type,
+        component_id=component.component_id)
+    self._driver_class = component.driver_class
+    self._component_executor_spec = component.executor_spec
+    self._input_dict = component.inputs.get_all()
+    self._output_dict = component.outputs.get_all()
+    self._exec_properties = component.exec_properties
+    self._pipeline_info = tfx_pipeline.pipeline_info
+    self._driver_args = data_types.DriverArgs(
+        enable_cache=tfx_pipeline.enable_cache)
+    self._metadata_connection_config = tfx_pipeline.metadata_connection_config
     self._component_id = component.component_id
+    # Created in setup() so that the launcher is not pickled with the DoFn.
+    self._component_launcher = None
+
+  def setup(self) -> None:
+    """Creates the component launcher once the DoFn is deserialized."""
+    self._component_launcher = component_launcher.BaseComponentLauncher(
+        component_info=self._component_info,
+        driver_class=self._driver_class,
+        component_executor_spec=self._component_executor_spec,
+        input_dict=self._input_dict,
+        output_dict=self._output_dict,
+        exec_properties=self._exec_properties,
+        pipeline_info=self._pipeline_info,
+        driver_args=self._driver_args,
+        metadata_connection_config=self._metadata_connection_config,
+        additional_pipeline_args=self._additional_pipeline_args)
 
   def process(self, element: Any, *signals: Iterable[Any]) -> None:
     """Executes component based on signals.
@@ -80,83 +143,292 @@ class _ComponentAsDoFn(beam.DoFn):
       *signals: side input signals indicate completeness of upstream components.
     """
     for signal in signals:
-      assert not list(signal), 'Signal PCollection should be empty.'
+      assert next(iter(signal), _EMPTY_SENTINEL) is _EMPTY_SENTINEL, (
+          'Signal PCollection should be empty.')
     self._run_component()
 
   def _run_component(self) -> None:
-    tf.logging.info('Component %s is running.', self._component_id)
+    # The launcher already logs when the driver of the component starts.
+    start_time = time.time()
     self._component_launcher.launch()
-    tf.logging.info('Component %s is finished.', self._component_id)
+    tf.logging.info('Component %s is finished in %.2f seconds.',
+                    self._component_id, time.time() - start_time)
+
+
+@beam.typehints.with_input_types(Any)
+@beam.typehints.with_output_types(Any)
+class _ChainedComponentAsDoFn(beam.DoFn):
+  """Wrap a linear chain of components as a single beam DoFn.
+
+  If a runner retries a failed bundle, the whole chain is launched again,
+  including the components which already finished. Chains are therefore only
+  built when cache is enabled, so that those components reuse the results of
+  their previous executions instead of being executed and published again.
+  """
+
+  def __init__(self, component_as_do_fns: List[_ComponentAsDoFn]):
+    """Initialize the _ChainedComponentAsDoFn.
+
+    Args:
+      component_as_do_fns: DoFns of the components in the chain, in execution
+        order. Each component only depends on the one before it.
+    """
+    self._component_as_do_fns = component_as_do_fns
+
+  def setup(self) -> None:
+    """Creates the launchers of all components in the chain."""
+    for component_as_do_fn in self._component_as_do_fns:
+      component_as_do_fn.setup()
+
+  def process(self, element: Any, *signals: Iterable[Any]) -> None:
+    """Executes components in the chain one after another based on signals.
+
+    Args:
+      element: a signal element to trigger the chain.
+      *signals: side input signals indicate completeness of upstream components
+        of the first component in the chain.
+    """
+    for signal in signals:
+      assert next(iter(signal), _EMPTY_SENTINEL) is _EMPTY_SENTINEL, (
+          'Signal PCollection should be empty.')
+    for component_as_do_fn in self._component_as_do_fns:
+      component_as_do_fn._run_component()  # pylint: disable=protected-access
+
+
+def _find_chains(tfx_pipeline: pipeline.Pipeline) -> List[List[int]]:
+  """Groups components into maximal linear chains.
+
+  A component is appended to the chain of its upstream component if it has
+  exactly one upstream component, which has no other downstream component.
+  Without cache, every component forms its own chain, since a retried chain
+  would execute the already finished components again.
+
+  Args:
+    tfx_pipeline: Logical pipeline containing components in topological order.
+
+  Returns:
+    Chains as lists of indices into tfx_pipeline.components, ordered by the
+    position of their first component.
+  """
+  chains = []
+  # Chain of each component, indexed by its position in pipeline.components.
+  chain_of = [None] * len(tfx_pipeline.components)
+  for index, component in enumerate(tfx_pipeline.components):
+    upstream_indices = tfx_pipeline.upstream_indices[index]
+    if (tfx_pipeline.enable_cache and len(upstream_indices) == 1 and
+        len(tfx_pipeline.children[tfx_pipeline.components[
+            upstream_indices[0]]]) == 1):
+      chain = chain_of[upstream_indices[0]]
+    else:
+      chain = []
+      chains.append(chain)
+    chain.append(index)
+    chain_of[index] = chain
+  return chains
 
 
 class BeamDagRunner(tfx_runner.TfxRunner):
   """Tfx runner on Beam."""
 
-  def __init__(self, beam_orchestrator_args: Optional[List[Text]] = None):
+  def __init__(self,
+               beam_orchestrator_args: Optional[List[Text]] = None,
+               max_workers: Optional[int] = None):
     """Initializes BeamDagRunner as a TFX orchestrator.
 
     Args:
       beam_orchestrator_args: beam args for the beam orchestrator. Note that
         this is different from the beam_pipeline_args within
         additional_pipeline_args, which is for beam pipelines in components.
+        A Beam pipeline is only built for the orchestrator if these args
+        request a runner other than the direct runner. Otherwise the pipeline
+        is run in-process and these args no longer take effect, except that
+        --direct_num_workers is used as max_workers if that is not given.
+      max_workers: maximum number of components run concurrently when the
+        pipeline is run in-process. Defaults to --direct_num_workers of
+        beam_orchestrator_args if set, or to 1, so components run one at a
+        time. Only raise it if the ML metadata store supports concurrent
+        writers (e.g. MySQL rather than SQLite) and the machine can hold the
+        Beam jobs of several components at once.
+
+    Raises:
+      ValueError: if max_workers is less than 1.
     """
     super(BeamDagRunner, self).__init__()
     self._beam_orchestrator_args = beam_orchestrator_args or []
+    if max_workers is None:
+      # Keeps the parallelism requested from the direct runner, whose args are
+      # otherwise ignored when the pipeline is run in-process.
+      direct_num_workers = _get_direct_num_workers(
+          self._beam_orchestrator_args)
+      max_workers = (
+          direct_num_workers
+          if direct_num_workers and direct_num_workers > 0 else 1)
+    elif max_workers < 1:
+      raise ValueError('max_workers must be at least 1, got %s' % max_workers)
+    self._max_workers = max_workers
 
   def run(self, tfx_pipeline: pipeline.Pipeline) -> None:
     """Deploys given logical pipeline on Beam.
 
+    Unless beam orchestrator args request a runner other than the direct
+    runner, the pipeline is run in-process without constructing a Beam
+    pipeline.
+
     Args:
       tfx_pipeline: Logical pipeline containing pipeline args and components.
     """
     # For CLI, while creating or updating pipeline, pipeline_args are extracted
     # and hence we avoid deploying the pipeline.
+    if 'TFX_JSON_EXPORT_PIPELINE_ARGS_PATH' in os.environ:
+      return
+
+    now = datetime.datetime.now()
+    tfx_pipeline.pipeline_info.run_id = now.isoformat()
+    run_timestamp = int(now.timestamp())
+    # Each component appends its own job name to these args.
+    beam_pipeline_args = [
+        arg for arg in tfx_pipeline.additional_pipeline_args.get(
+            'beam_pipeline_args', []) if not arg.startswith('--job_name')
+    ]
+
+    if _is_local_runner(self._beam_orchestrator_args):
+      if self._beam_orchestrator_args:
+        tf.logging.warning(
+            'Running pipeline in-process with max_workers=%d since no '
+            'distributed runner is requested. Beam orchestrator args %s are '
+            'ignored.', self._max_workers, self._beam_orchestrator_args)
+      self._run_local(tfx_pipeline, run_timestamp, beam_pipeline_args)
+    else:
+      self._run_beam(tfx_pipeline, run_timestamp, beam_pipeline_args)
 
+  def _run_local(self, tfx_pipeline: pipeline.Pipeline, run_timestamp: int,
+                 beam_pipeline_args: List[Text]) -> None:
+    """Runs given logical pipeline in-process with a thread pool.
+
+    Components are scheduled with Kahn's algorithm: a component is launched as
+    soon as all of its upstream components are finished, so independent
+    branches of the pipeline run concurrently.
+
+    Args:
+      tfx_pipeline: Logical pipeline containing pipeline args and components.
+      run_timestamp: Timestamp in seconds of current pipeline run.
+      beam_pipeline_args: Beam pipeline args for components without job name.
+    """
+    in_degree = dict(tfx_pipeline.in_degrees)
+    children = tfx_pipeline.children
+    # Components whose upstream components are all finished.
+    ready = collections.deque(
+        c for c in tfx_pipeline.components if not in_degree[c])
+
+    with futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+      # Maps future of a running component to the component itself.
+      running = {}
+      while ready or running:
+        # Only submits as many components as there are workers, so that no
+        # component is left queued in the executor once another one fails.
+        while ready and len(running) < self._max_workers:
+          component = ready.popleft()
+          running[executor.submit(self._launch_component, component,
+                                  tfx_pipeline, run_timestamp,
+                                  beam_pipeline_args)] = component
+
+        done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+          component = running.pop(future)
+          try:
+            future.result()
+          except Exception:
+            # Components not started yet are never launched, the running ones
+            # are waited for when the executor shuts down.
+            for pending_future in running:
+              pending_future.cancel()
+            raise
+          for child in children[component]:
+            in_degree[child] -= 1
+            if not in_degree[child]:
+              ready.append(child)
+
+  def _launch_component(self, component: base_component.BaseComponent,
+                        tfx_pipeline: pipeline.Pipeline, run_timestamp: int,
+                        beam_pipeline_args: List[Text]) -> None:
+    # Drivers and publishers update the artifacts of the component. Beam
+    # isolates them by pickling the DoFn, so a copy is launched here to leave
+    # the logical pipeline untouched and runnable again.
+    component_as_do_fn = copy.deepcopy(
+        _ComponentAsDoFn(component, tfx_pipeline, run_timestamp,
+                         beam_pipeline_args))
+    component_as_do_fn.setup()
+    component_as_do_fn._run_component()  # pylint: disable=protected-access
+
+  def _run_beam(self, tfx_pipeline: pipeline.Pipeline, run_timestamp: int,
+                beam_pipeline_args: List[Text]) -> None:
+    """Runs given logical pipeline as a Beam pipeline.
+
+    Args:
+      tfx_pipeline: Logical pipeline containing pipeline args and components.
+      run_timestamp: Timestamp in seconds of current pipeline run.
+      beam_pipeline_args: Beam pipeline args for components without job name.
+    """
     # Append a beam orchestrator pipeline job name if none is present
     if not any(
-      [arg.startswith("--job_name=") for arg in self._beam_orchestrator_args]):
-      # Google Dataflow restricts naming to only alphanumeric and dashes
-      orchestrator_job_name = re.sub(
-        r'[^0-9a-zA-Z-]+',
-        '-',
-        '{pipeline_name}-{ts}'.format(
-          pipeline_name=tfx_pipeline.pipeline_info.pipeline_name,
-          ts=int(datetime.datetime.timestamp(datetime.datetime.now()))
-        ).lower()
-      )
+        arg.startswith('--job_name=') for arg in self._beam_orchestrator_args):
+      orchestrator_job_name = '{pipeline_name}-{ts}'.format(
+          pipeline_name=_to_job_name_part(
+              tfx_pipeline.pipeline_info.pipeline_name),
+          ts=run_timestamp)
       self._beam_orchestrator_args.append(
         '--job_name={}'.format(orchestrator_job_name))
 
-    if 'TFX_JSON_EXPORT_PIPELINE_ARGS_PATH' in os.environ:
-      return
-
-    tfx_pipeline.pipeline_info.run_id = datetime.datetime.now().isoformat()
-
     with beam.Pipeline(argv=self._beam_orchestrator_args) as p:
       # Uses for triggering the component DoFns.
       root = p | 'CreateRoot' >> beam.Create([None])
 
-      # Stores mapping of component to its signal.
-      signal_map = {}
-      # pipeline.components are in topological order.
-      for component in tfx_pipeline.components:
-        component_id = component.component_id
-
-        # Signals from upstream components.
-        signals_to_wait = []
-        if component.upstream_nodes:
-          for upstream_node in component.upstream_nodes:
-            assert upstream_node in signal_map, ('Components is not in '
-                                                 'topological order')
-            signals_to_wait.append(signal_map[upstream_node])
-        tf.logging.info('Component %s depends on %s.', component_id,
-                        [s.producer.full_label for s in signals_to_wait])
-
-        # Each signal is an empty PCollection. AsIter ensures component will be
-        # triggered after upstream components are finished.
-        signal_map[component] = (
-            root
-            | 'Run[%s]' % component_id >> beam.ParDo(
-                _ComponentAsDoFn(component, tfx_pipeline),
-                *[beam.pvalue.AsIter(s) for s in signals_to_wait]))
+      # Stores signal of each component, indexed by its position in
+      # pipeline.components.
+      signals = [None] * len(tfx_pipeline.components)
+      # Components in a linear chain are run by a single DoFn, so that no
+      # signal is materialized between them.
+      for chain in _find_chains(tfx_pipeline):
+        chain_components = [tfx_pipeline.components[i] for i in chain]
+        component_id = ','.join(c.component_id for c in chain_components)
+        component_as_do_fns = [
+            _ComponentAsDoFn(c, tfx_pipeline, run_timestamp,
+                             beam_pipeline_args) for c in chain_components
+        ]
+        if len(component_as_do_fns) == 1:
+          [component_as_do_fn] = component_as_do_fns
+        else:
+          component_as_do_fn = _ChainedComponentAsDoFn(component_as_do_fns)
+        upstream_indices = tfx_pipeline.upstream_indices[chain[0]]
+
+        if not upstream_indices:
+          # Components without upstream components only wait for the root.
+          signal_out = (
+              root
+              | 'Run[%s]' % component_id >> beam.ParDo(component_as_do_fn))
+        else:
+          # Signals from upstream components, which are all already created
+          # since chains are in topological order.
+          signals_to_wait = [signals[i] for i in upstream_indices]
+          # Avoids building the list of labels if it will not be logged.
+          if tf.logging.get_verbosity() <= tf.logging.INFO:
+            tf.logging.info('Component %s depends on %s.', component_id,
+                            [s.producer.full_label for s in signals_to_wait])
+
+          # Each signal is an empty PCollection. Signals of all upstream
+          # components are flattened into one, so a single AsIter side input
+          # ensures component will be triggered after upstream components are
+          # finished.
+          if len(signals_to_wait) > 1:
+            signal = (
+                signals_to_wait
+                | 'Wait[%s]' % component_id >> beam.Flatten())
+          else:
+            [signal] = signals_to_wait
+          signal_out = (
+              root
+              | 'Run[%s]' % component_id >> beam.ParDo(
+                  component_as_do_fn, beam.pvalue.AsIter(signal)))
+        for index in chain:
+          signals[index] = signal_out
         tf.logging.info('Component %s is scheduled.', component_id)
@@ -17,18 +17,26 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import threading
+
 import mock
 import tensorflow as tf
+from typing import Any, Dict, List, Text
 from ml_metadata.proto import metadata_store_pb2
 from tfx import types
 from tfx.components.base import base_component
 from tfx.components.base import base_executor
 from tfx.components.base import executor_spec
+from tfx.orchestration import metadata
 from tfx.orchestration import pipeline
 from tfx.orchestration.beam import beam_dag_runner
+from tfx.types import artifact_utils
 from tfx.types.component_spec import ChannelParameter
 
 _executed_components = []
+# Output artifact types of the components run by _FakeExecutor.
+_executed_output_types = []
 
 
 class _FakeComponentAsDoFn(beam_dag_runner._ComponentAsDoFn):
@@ -37,6 +45,27 @@ class _FakeComponentAsDoFn(beam_dag_runner._ComponentAsDoFn):
     _executed_components.append(self._component_id)
 
 
+# Only passed once sibling components b and c are running at the same time.
+_sibling_barrier = threading.Barrier(2)
+
+
+class _OverlappingSiblingsComponentAsDoFn(_FakeComponentAsDoFn):
+
+  def _run_component(self):
+    if self._component_id in ('_FakeComponent.b', '_FakeComponent.c'):
+      _sibling_barrier.wait(timeout=10)
+    super(_OverlappingSiblingsComponentAsDoFn, self)._run_component()
+
+
+class _FailingSiblingsComponentAsDoFn(_FakeComponentAsDoFn):
+
+  def _run_component(self):
+    # Records the launch before failing.
+    super(_FailingSiblingsComponentAsDoFn, self)._run_component()
+    if self._component_id in ('_FakeComponent.b', '_FakeComponent.c'):
+      raise RuntimeError('Component %s failed.' % self._component_id)
+
+
 # We define fake component spec classes below for testing. Note that we can't
 # programmatically generate component using anonymous classes for testing
 # because of a limitation in the "dill" pickler component used by Apache Beam.
@@ -82,10 +111,19 @@ class _FakeComponentSpecE(types.ComponentSpec):
   OUTPUTS = {'output': ChannelParameter(type_name='e')}
 
 
+class _FakeExecutor(base_executor.BaseExecutor):
+
+  def Do(self, input_dict: Dict[Text, List[types.Artifact]],
+         output_dict: Dict[Text, List[types.Artifact]],
+         exec_properties: Dict[Text, Any]) -> None:
+    _executed_output_types.append(
+        artifact_utils.get_single_instance(output_dict['output']).type_name)
+
+
 class _FakeComponent(base_component.BaseComponent):
 
   SPEC_CLASS = types.ComponentSpec
-  EXECUTOR_SPEC = executor_spec.ExecutorClassSpec(base_executor.BaseExecutor)
+  EXECUTOR_SPEC = executor_spec.ExecutorClassSpec(_FakeExecutor)
 
   def __init__(self, spec: types.ComponentSpec):
     instance_name = spec.__class__.__name__.replace(
@@ -94,49 +132,253 @@ class _FakeComponent(base_component.BaseComponent):
                                          instance_name=instance_name)
 
 
+def _make_test_pipeline():
+  component_a = _FakeComponent(
+      _FakeComponentSpecA(output=types.Channel(type_name='a')))
+  component_b = _FakeComponent(
+      _FakeComponentSpecB(
+          a=component_a.outputs.output, output=types.Channel(type_name='b')))
+  component_c = _FakeComponent(
+      _FakeComponentSpecC(
+          a=component_a.outputs.output, output=types.Channel(type_name='c')))
+  component_d = _FakeComponent(
+      _FakeComponentSpecD(
+          b=component_b.outputs.output,
+          c=component_c.outputs.output,
+          output=types.Channel(type_name='d')))
+  component_e = _FakeComponent(
+      _FakeComponentSpecE(
+          a=component_a.outputs.output,
+          b=component_b.outputs.output,
+          d=component_d.outputs.output,
+          output=types.Channel(type_name='e')))
+
+  return pipeline.Pipeline(
+      pipeline_name='x',
+      pipeline_root='y',
+      metadata_connection_config=metadata_store_pb2.ConnectionConfig(),
+      components=[
+          component_d, component_c, component_a, component_b, component_e
+      ])
+
+
 class BeamDagRunnerTest(tf.test.TestCase):
 
+  def setUp(self):
+    super(BeamDagRunnerTest, self).setUp()
+    del _executed_components[:]
+    del _executed_output_types[:]
+    _sibling_barrier.reset()
+
+  def _assertExecutedInOrder(self):
+    self.assertItemsEqual(_executed_components, [
+        '_FakeComponent.a', '_FakeComponent.b', '_FakeComponent.c',
+        '_FakeComponent.d', '_FakeComponent.e'
+    ])
+    self.assertEqual(_executed_components[0], '_FakeComponent.a')
+    self.assertEqual(_executed_components[3], '_FakeComponent.d')
+    self.assertEqual(_executed_components[4], '_FakeComponent.e')
+
   @mock.patch.multiple(
       beam_dag_runner,
       _ComponentAsDoFn=_FakeComponentAsDoFn,
   )
   def testRun(self):
+    beam_dag_runner.BeamDagRunner().run(_make_test_pipeline())
+    self._assertExecutedInOrder()
+
+  @mock.patch.multiple(
+      beam_dag_runner,
+      _ComponentAsDoFn=_FakeComponentAsDoFn,
+  )
+  def testRunWithMultipleWorkers(self):
+    beam_dag_runner.BeamDagRunner(max_workers=2).run(_make_test_pipeline())
+    self._assertExecutedInOrder()
+
+  @mock.patch.multiple(
+      beam_dag_runner,
+      _ComponentAsDoFn=_OverlappingSiblingsComponentAsDoFn,
+  )
+  def testRunSiblingsConcurrently(self):
+    # Raises BrokenBarrierError if b and c do not run at the same time.
+    beam_dag_runner.BeamDagRunner(max_workers=2).run(_make_test_pipeline())
+    self._assertExecutedInOrder()
+
+  @mock.patch.multiple(
+      beam_dag_runner,
+      _ComponentAsDoFn=_FailingSiblingsComponentAsDoFn,
+  )
+  def testRunWithFailedComponent(self):
+    with self.assertRaisesRegexp(RuntimeError,
+                                 r'Component _FakeComponent\.[bc] failed\.'):
+      beam_dag_runner.BeamDagRunner(max_workers=1).run(_make_test_pipeline())
+    # b and c are both ready after a. Whichever of them is launched first
+    # fails, so the other one, as well as the descendants d and e, are never
+    # launched.
+    self.assertEqual(len(_executed_components), 2)
+    self.assertEqual(_executed_components[0], '_FakeComponent.a')
+    self.assertIn(_executed_components[1],
+                  ['_FakeComponent.b', '_FakeComponent.c'])
+
+  def _makeSqliteTestPipeline(self):
+    test_dir = os.path.join(
+        os.environ.get('TEST_UNDECLARED_OUTPUTS_DIR', self.get_temp_dir()),
+        self._testMethodName)
+    connection_config = metadata.sqlite_metadata_connection_config(
+        os.path.join(test_dir, 'metadata.db'))
+
+    # Component b and c both only depend on a. Components are launched for
+    # real, so their drivers and publishers all write to the SQLite store.
     component_a = _FakeComponent(
-        _FakeComponentSpecA(output=types.Channel(type_name='a')))
+        _FakeComponentSpecA(
+            output=types.Channel(
+                type_name='a', artifacts=[types.Artifact('a')])))
     component_b = _FakeComponent(
         _FakeComponentSpecB(
-            a=component_a.outputs.output, output=types.Channel(type_name='b')))
+            a=component_a.outputs.output,
+            output=types.Channel(
+                type_name='b', artifacts=[types.Artifact('b')])))
     component_c = _FakeComponent(
         _FakeComponentSpecC(
-            a=component_a.outputs.output, output=types.Channel(type_name='c')))
-    component_d = _FakeComponent(
-        _FakeComponentSpecD(
-            b=component_b.outputs.output,
-            c=component_c.outputs.output,
-            output=types.Channel(type_name='d')))
-    component_e = _FakeComponent(
-        _FakeComponentSpecE(
             a=component_a.outputs.output,
-            b=component_b.outputs.output,
-            d=component_d.outputs.output,
-            output=types.Channel(type_name='e')))
+            output=types.Channel(
+                type_name='c', artifacts=[types.Artifact('c')])))
+    return pipeline.Pipeline(
+        pipeline_name='x',
+        pipeline_root=os.path.join(test_dir, 'pipeline_root'),
+        metadata_connection_config=connection_config,
+        components=[component_c, component_b, component_a])
+
+  def _assertRunCompleted(self, test_pipeline, run_id):
+    with metadata.Metadata(test_pipeline.metadata_connection_config) as m:
+      self.assertDictEqual(
+          m.get_execution_states('x', run_id), {
+              '_FakeComponent.a': 'complete',
+              '_FakeComponent.b': 'complete',
+              '_FakeComponent.c': 'complete',
+          })
+
+  def testRunSiblingsWithSqliteMetadata(self):
+    test_pipeline = self._makeSqliteTestPipeline()
+    beam_dag_runner.BeamDagRunner().run(test_pipeline)
+
+    self.assertItemsEqual(_executed_output_types, ['a', 'b', 'c'])
+    self.assertEqual(_executed_output_types[0], 'a')
+    self._assertRunCompleted(test_pipeline,
+                             test_pipeline.pipeline_info.run_id)
+
+  def testRunPipelineTwiceWithSqliteMetadata(self):
+    test_pipeline = self._makeSqliteTestPipeline()
+    runner = beam_dag_runner.BeamDagRunner()
+    runner.run(test_pipeline)
+    first_run_id = test_pipeline.pipeline_info.run_id
+    # Without cache, the second run publishes new output artifacts, which
+    # fails if the first run set ids on the artifacts of the pipeline.
+    runner.run(test_pipeline)
+    second_run_id = test_pipeline.pipeline_info.run_id
+
+    self.assertNotEqual(first_run_id, second_run_id)
+    self.assertItemsEqual(_executed_output_types,
+                          ['a', 'b', 'c', 'a', 'b', 'c'])
+    self._assertRunCompleted(test_pipeline, first_run_id)
+    self._assertRunCompleted(test_pipeline, second_run_id)
+    for component in test_pipeline.components:
+      for artifact in component.outputs.output.get():
+        self.assertFalse(artifact.id)
+        self.assertFalse(artifact.uri)
+
+  @mock.patch.multiple(
+      beam_dag_runner,
+      _ComponentAsDoFn=_FakeComponentAsDoFn,
+      _is_local_runner=lambda _: False,
+  )
+  def testRunWithBeamOrchestratorArgs(self):
+    beam_dag_runner.BeamDagRunner(
+        beam_orchestrator_args=['--runner=DirectRunner']).run(
+            _make_test_pipeline())
+    self._assertExecutedInOrder()
 
+  @mock.patch.multiple(
+      beam_dag_runner,
+      _ComponentAsDoFn=_FakeComponentAsDoFn,
+      _is_local_runner=lambda _: False,
+  )
+  def testRunWithChainedComponents(self):
+    component_a = _FakeComponent(
+        _FakeComponentSpecA(output=types.Channel(type_name='a')))
+    component_b = _FakeComponent(
+        _FakeComponentSpecB(
+            a=component_a.outputs.output, output=types.Channel(type_name='b')))
     test_pipeline = pipeline.Pipeline(
         pipeline_name='x',
         pipeline_root='y',
         metadata_connection_config=metadata_store_pb2.ConnectionConfig(),
-        components=[
-            component_d, component_c, component_a, component_b, component_e
-        ])
+        components=[component_b, component_a],
+        enable_cache=True)
 
-    beam_dag_runner.BeamDagRunner().run(test_pipeline)
-    self.assertItemsEqual(_executed_components, [
-        '_FakeComponent.a', '_FakeComponent.b', '_FakeComponent.c',
-        '_FakeComponent.d', '_FakeComponent.e'
-    ])
-    self.assertEqual(_executed_components[0], '_FakeComponent.a')
-    self.assertEqual(_executed_components[3], '_FakeComponent.d')
-    self.assertEqual(_executed_components[4], '_FakeComponent.e')
+    self.assertEqual(beam_dag_runner._find_chains(test_pipeline), [[0, 1]])
+    beam_dag_runner.BeamDagRunner(
+        beam_orchestrator_args=['--runner=DirectRunner']).run(test_pipeline)
+    self.assertEqual(_executed_components,
+                     ['_FakeComponent.a', '_FakeComponent.b'])
+
+  def testComponentAsDoFnDoesNotKeepComponent(self):
+    test_pipeline = _make_test_pipeline()
+    do_fn = beam_dag_runner._ComponentAsDoFn(
+        test_pipeline.components[-1], test_pipeline, 0, [])
+    # The component references all other components of the pipeline, which
+    # should not be pickled with the DoFn.
+    for value in vars(do_fn).values():
+      self.assertNotIsInstance(value, base_component.BaseComponent)
+    self.assertIsNone(do_fn._component_launcher)
+    do_fn.setup()
+    self.assertIsNotNone(do_fn._component_launcher)
+
+  def testInvalidMaxWorkers(self):
+    with self.assertRaises(ValueError):
+      beam_dag_runner.BeamDagRunner(max_workers=0)
+    with self.assertRaises(ValueError):
+      beam_dag_runner.BeamDagRunner(max_workers=-1)
+
+  def testMaxWorkersFromDirectNumWorkers(self):
+    self.assertEqual(
+        beam_dag_runner.BeamDagRunner(
+            beam_orchestrator_args=['--direct_num_workers=3'])._max_workers, 3)
+    self.assertEqual(
+        beam_dag_runner.BeamDagRunner(
+            beam_orchestrator_args=['--direct_num_workers=3'],
+            max_workers=2)._max_workers, 2)
+    self.assertEqual(beam_dag_runner.BeamDagRunner()._max_workers, 1)
+
+  def testIsLocalRunner(self):
+    self.assertTrue(beam_dag_runner._is_local_runner([]))
+    self.assertTrue(
+        beam_dag_runner._is_local_runner(['--runner=DirectRunner']))
+    self.assertTrue(beam_dag_runner._is_local_runner(['--job_name=x']))
+    self.assertFalse(
+        beam_dag_runner._is_local_runner(['--runner=DataflowRunner']))
+
+  def testFindChainsWithoutCache(self):
+    component_a = _FakeComponent(
+        _FakeComponentSpecA(output=types.Channel(type_name='a')))
+    component_b = _FakeComponent(
+        _FakeComponentSpecB(
+            a=component_a.outputs.output, output=types.Channel(type_name='b')))
+    test_pipeline = pipeline.Pipeline(
+        pipeline_name='x',
+        pipeline_root='y',
+        metadata_connection_config=metadata_store_pb2.ConnectionConfig(),
+        components=[component_b, component_a])
+
+    # A retried chain would execute a again, so nothing is fused.
+    self.assertEqual(beam_dag_runner._find_chains(test_pipeline), [[0], [1]])
+
+  def testFindChains(self):
+    # No component in the test pipeline has a single upstream component
+    # which has no other downstream component.
+    self.assertEqual(
+        beam_dag_runner._find_chains(_make_test_pipeline()),
+        [[0], [1], [2], [3], [4]])
 
 
 if __name__ == '__main__':
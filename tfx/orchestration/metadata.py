@@ -381,15 +381,19 @@ class Metadata(object):
       for single_input in input_list:
         input_ids.add(single_input.artifact.id)
 
+    # Fetches events of all candidate executions in a single call.
+    input_ids_per_execution = collections.defaultdict(set)
+    if candidate_execution_ids:
+      for event in self._store.get_events_by_execution_ids(
+          candidate_execution_ids):
+        if event.type in [
+            metadata_store_pb2.Event.INPUT,
+            metadata_store_pb2.Event.DECLARED_INPUT
+        ]:
+          input_ids_per_execution[event.execution_id].add(event.artifact_id)
+
     for execution_id in candidate_execution_ids:
-      events = self._store.get_events_by_execution_ids([execution_id])
-      execution_input_ids = set([
-          event.artifact_id for event in events if event.type in [
-              metadata_store_pb2.Event.INPUT,
-              metadata_store_pb2.Event.DECLARED_INPUT
-          ]
-      ])
-      if input_ids == execution_input_ids:
+      if input_ids == input_ids_per_execution[execution_id]:
         tf.logging.info(
             'Found matching execution with all input artifacts: %s' %
             execution_id)
@@ -469,13 +473,24 @@ class Metadata(object):
       RuntimeError: path change without clean metadata.
     """
 
+    output_events = [
+        event
+        for event in self._store.get_events_by_execution_ids([execution_id])
+        if event.type == metadata_store_pb2.Event.OUTPUT
+    ]
+    # Fetches all output artifacts in a single call instead of one per event.
+    artifacts_by_id = {}
+    if output_events:
+      for artifact in self._store.get_artifacts_by_id(
+          [event.artifact_id for event in output_events]):
+        artifacts_by_id[artifact.id] = artifact
+
     name_to_index_to_artifacts = collections.defaultdict(dict)
-    for event in self._store.get_events_by_execution_ids([execution_id]):
-      if event.type == metadata_store_pb2.Event.OUTPUT:
-        [artifact] = self._store.get_artifacts_by_id([event.artifact_id])
-        output_key = event.path.steps[0].key
-        output_index = event.path.steps[1].index
-        name_to_index_to_artifacts[output_key][output_index] = artifact
+    for event in output_events:
+      output_key = event.path.steps[0].key
+      output_index = event.path.steps[1].index
+      name_to_index_to_artifacts[output_key][output_index] = artifacts_by_id[
+          event.artifact_id]
     for output_name, output_list in output_dict.items():
       if output_name not in name_to_index_to_artifacts:
         raise RuntimeError('Unmatched output name from previous execution.')
@@ -289,25 +289,35 @@ class MetadataTest(tf.test.TestCase):
   def testGetCachedExecutionIds(self):
     with metadata.Metadata(connection_config=self._connection_config) as m:
       mock_store = mock.Mock()
-      mock_store.get_events_by_execution_ids.side_effect = [
-          [
-              metadata_store_pb2.Event(
-                  artifact_id=1, type=metadata_store_pb2.Event.INPUT)
-          ],
-          [
-              metadata_store_pb2.Event(
-                  artifact_id=1, type=metadata_store_pb2.Event.INPUT),
-              metadata_store_pb2.Event(
-                  artifact_id=2, type=metadata_store_pb2.Event.INPUT),
-              metadata_store_pb2.Event(
-                  artifact_id=3, type=metadata_store_pb2.Event.INPUT)
-          ],
-          [
-              metadata_store_pb2.Event(
-                  artifact_id=1, type=metadata_store_pb2.Event.INPUT),
-              metadata_store_pb2.Event(
-                  artifact_id=2, type=metadata_store_pb2.Event.INPUT),
-          ],
+      mock_store.get_events_by_execution_ids.return_value = [
+          metadata_store_pb2.Event(
+              execution_id=3,
+              artifact_id=1,
+              type=metadata_store_pb2.Event.INPUT),
+          metadata_store_pb2.Event(
+              execution_id=2,
+              artifact_id=1,
+              type=metadata_store_pb2.Event.INPUT),
+          metadata_store_pb2.Event(
+              execution_id=2,
+              artifact_id=2,
+              type=metadata_store_pb2.Event.INPUT),
+          metadata_store_pb2.Event(
+              execution_id=2,
+              artifact_id=3,
+              type=metadata_store_pb2.Event.INPUT),
+          metadata_store_pb2.Event(
+              execution_id=1,
+              artifact_id=1,
+              type=metadata_store_pb2.Event.INPUT),
+          metadata_store_pb2.Event(
+              execution_id=1,
+              artifact_id=2,
+              type=metadata_store_pb2.Event.INPUT),
+          metadata_store_pb2.Event(
+              execution_id=1,
+              artifact_id=3,
+              type=metadata_store_pb2.Event.OUTPUT),
       ]
       m._store = mock_store
 
@@ -322,6 +332,58 @@ class MetadataTest(tf.test.TestCase):
       }
 
       self.assertEqual(1, m._get_cached_execution_id(input_dict, [3, 2, 1]))
+      mock_store.get_events_by_execution_ids.assert_called_once_with([3, 2, 1])
+
+  def testFetchPreviousResultArtifacts(self):
+    with metadata.Metadata(connection_config=self._connection_config) as m:
+      mock_store = mock.Mock()
+      mock_store.get_events_by_execution_ids.return_value = [
+          m._prepare_event(
+              execution_id=1,
+              artifact_id=1,
+              key='input',
+              index=0,
+              event_type=metadata_store_pb2.Event.INPUT),
+          m._prepare_event(
+              execution_id=1,
+              artifact_id=3,
+              key='examples',
+              index=1,
+              event_type=metadata_store_pb2.Event.OUTPUT),
+          m._prepare_event(
+              execution_id=1,
+              artifact_id=2,
+              key='examples',
+              index=0,
+              event_type=metadata_store_pb2.Event.OUTPUT),
+          m._prepare_event(
+              execution_id=1,
+              artifact_id=4,
+              key='model',
+              index=0,
+              event_type=metadata_store_pb2.Event.OUTPUT),
+      ]
+      mock_store.get_artifacts_by_id.return_value = [
+          metadata_store_pb2.Artifact(id=4),
+          metadata_store_pb2.Artifact(id=2),
+          metadata_store_pb2.Artifact(id=3),
+      ]
+      m._store = mock_store
+
+      output_dict = {
+          'examples': [
+              standard_artifacts.Examples(),
+              standard_artifacts.Examples()
+          ],
+          'model': [standard_artifacts.Model()],
+      }
+      updated_output_dict = m.fetch_previous_result_artifacts(output_dict, 1)
+
+      mock_store.get_events_by_execution_ids.assert_called_once_with([1])
+      mock_store.get_artifacts_by_id.assert_called_once_with([3, 2, 4])
+      self.assertEqual(
+          [a.id for a in updated_output_dict['examples']], [2, 3])
+      self.assertEqual([a.id for a in updated_output_dict['model']], [4])
 
   def testSearchArtifacts(self):
     with metadata.Metadata(connection_config=self._connection_config) as m:
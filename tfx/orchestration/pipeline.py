@@ -25,7 +25,7 @@ import os
 
 import tensorflow as tf
 
-from typing import List, Optional, Text
+from typing import Dict, List, Optional, Text
 from ml_metadata.proto import metadata_store_pb2
 from tensorflow.python.util import deprecation  # pylint: disable=g-direct-tensorflow-import
 from tfx.components.base import base_component
@@ -80,6 +80,11 @@ class Pipeline(object):
     enable_cache: whether or not cache is enabled for this run.
     metadata_connection_config: the config to connect to ML metadata.
     additional_pipeline_args: other pipeline args. e.g. beam runner args.
+    children: mapping from each component to its downstream components.
+    in_degrees: mapping from each component to its number of upstream
+      components.
+    upstream_indices: for each component in components, the indices of its
+      upstream components in components.
   """
 
   def __init__(self,
@@ -141,8 +146,8 @@ class Pipeline(object):
         'additional_pipeline_args', {})
 
     # Store pipeline_args in a json file only when temp file exists.
-    if 'TFX_JSON_EXPORT_PIPELINE_ARGS_PATH' in os.environ:
-      pipeline_args_path = os.environ.get('TFX_JSON_EXPORT_PIPELINE_ARGS_PATH')
+    pipeline_args_path = os.environ.get('TFX_JSON_EXPORT_PIPELINE_ARGS_PATH')
+    if pipeline_args_path is not None:
       with open(pipeline_args_path, 'w') as f:
         json.dump(self.pipeline_args, f)
 
@@ -186,23 +191,54 @@ class Pipeline(object):
           component.add_upstream_node(producer_map[i])
           producer_map[i].add_downstream_node(component)
 
-    self._components = []
-    visited = set()
-
-    # Finds the nodes with indegree 0.
-    current_layer = [c for c in deduped_components if not c.upstream_nodes]
-    # Sorts component in topological order.
-    while current_layer:
-      next_layer = []
-      for component in current_layer:
-        self._components.append(component)
-        visited.add(component)
-        for downstream_node in component.downstream_nodes:
-          if downstream_node.upstream_nodes.issubset(visited):
-            next_layer.append(downstream_node)
-      current_layer = next_layer
+    # Caches the adjacency of the DAG so that runners do not need to traverse
+    # the graph again for every run. Nodes outside of this pipeline, e.g. from
+    # another pipeline sharing a component, are ignored.
+    parents = {
+        c: [u for u in c.upstream_nodes if u in deduped_components]
+        for c in deduped_components
+    }
+    self._children = {
+        c: [d for d in c.downstream_nodes if d in deduped_components]
+        for c in deduped_components
+    }
+    self._in_degrees = {c: len(parents[c]) for c in deduped_components}
+
+    # Sorts component in topological order with Kahn's algorithm, starting
+    # from the nodes with indegree 0. Components are appended to the list
+    # while it is iterated, once all of their upstream nodes are visited.
+    remaining_in_degrees = dict(self._in_degrees)
+    self._components = [
+        c for c in deduped_components if not remaining_in_degrees[c]
+    ]
+    for component in self._components:
+      for downstream_node in self._children[component]:
+        remaining_in_degrees[downstream_node] -= 1
+        if not remaining_in_degrees[downstream_node]:
+          self._components.append(downstream_node)
     # If there is a cycle in the graph, upon visiting the cycle, no node will be
     # ready to be processed because it is impossible to find a single node that
     # has all its dependencies visited.
     if len(self._components) < len(deduped_components):
       raise RuntimeError('There is a cycle in the pipeline')
+
+    component_indices = {c: i for i, c in enumerate(self._components)}
+    self._upstream_indices = [
+        [component_indices[u] for u in parents[c]] for c in self._components
+    ]
+
+  @property
+  def children(self) -> Dict[base_component.BaseComponent,
+                             List[base_component.BaseComponent]]:
+    """Downstream components of each component in the pipeline."""
+    return self._children
+
+  @property
+  def in_degrees(self) -> Dict[base_component.BaseComponent, int]:
+    """Number of upstream components of each component."""
+    return self._in_degrees
+
+  @property
+  def upstream_indices(self) -> List[List[int]]:
+    """Indices in components of the upstream components of each component."""
+    return self._upstream_indices
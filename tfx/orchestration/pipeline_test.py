@@ -111,6 +111,15 @@ class PipelineTest(tf.test.TestCase):
     self.assertItemsEqual(my_pipeline.components[0].downstream_nodes,
                           [component_b, component_c, component_e])
     self.assertEqual(my_pipeline.components[-1], component_e)
+    self.assertItemsEqual(my_pipeline.children[component_a],
+                          [component_b, component_c, component_e])
+    self.assertEqual(my_pipeline.children[component_e], [])
+    self.assertEqual(my_pipeline.in_degrees[component_a], 0)
+    self.assertEqual(my_pipeline.in_degrees[component_e], 3)
+    self.assertItemsEqual([
+        my_pipeline.components[i] for i in my_pipeline.upstream_indices[-1]
+    ], [component_a, component_b, component_d])
+    self.assertEqual(my_pipeline.upstream_indices[0], [])
     self.assertDictEqual(
         my_pipeline.pipeline_args, {
             'pipeline_name': 'a',
@@ -169,6 +178,36 @@ class PipelineTest(tf.test.TestCase):
           components=[component_c, component_d, component_b, component_a],
           metadata_connection_config=self._metadata_connection_config)
 
+  def testPipelineWithComponentFromOtherPipeline(self):
+    component_a = _make_fake_component_instance('component_a', {}, {})
+    component_b = _make_fake_component_instance(
+        'component_b', {'a': component_a.outputs.output}, {})
+    component_c = _make_fake_component_instance(
+        'component_c', {'b': component_b.outputs.output}, {})
+    pipeline.Pipeline(
+        pipeline_name='a',
+        pipeline_root='b',
+        components=[component_b, component_a],
+        metadata_connection_config=self._metadata_connection_config)
+
+    # component_a is an upstream node of component_b, but is not part of this
+    # pipeline.
+    my_pipeline = pipeline.Pipeline(
+        pipeline_name='a',
+        pipeline_root='b',
+        components=[component_c, component_b],
+        metadata_connection_config=self._metadata_connection_config)
+    self.assertEqual(my_pipeline.components, [component_b, component_c])
+    self.assertDictEqual(my_pipeline.children, {
+        component_b: [component_c],
+        component_c: [],
+    })
+    self.assertDictEqual(my_pipeline.in_degrees, {
+        component_b: 0,
+        component_c: 1,
+    })
+    self.assertEqual(my_pipeline.upstream_indices, [[], [0]])
+
   def testPipelineWithDuplicatedComponentId(self):
     component_a = _make_fake_component_instance('component_a', {}, {})
     component_b = _make_fake_component_instance('component_a', {}, {})